@@ -1,17 +1,30 @@
 # backend/app.py
 from fastapi import FastAPI, File, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
-from pydantic import BaseModel
-import uvicorn
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import FileResponse, JSONResponse, Response
+from pydantic import BaseModel, ConfigDict, Field
+import aiofiles
+import anyio
+import asyncio
+import functools
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from contextlib import asynccontextmanager
 import shutil
 from pathlib import Path
 import logging
-import google.generativeai as genai
 import os
-import json
+import orjson
+import re
+import stat
+from email.utils import formatdate, parsedate_to_datetime
+import string
+import hashlib
+import threading
 import traceback
+from collections import OrderedDict
 from typing import Optional
 
 # Import PDF processing
@@ -20,7 +33,24 @@ from extraction import process_pdf
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="PDF Section Extractor")
+
+class _ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (FastAPI's own ORJSONResponse is deprecated)."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # ✅ Raise the default threadpool limit (40) so blocking work offloaded via
+    # anyio (Gemini calls, sync endpoints) doesn't queue up under load
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 100
+    yield
+    EXECUTOR.shutdown(wait=False)
+
+
+app = FastAPI(title="PDF Section Extractor", lifespan=lifespan, default_response_class=_ORJSONResponse)
 
 # Allow CORS for local dev
 app.add_middleware(
@@ -31,48 +61,165 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class _ApiGZipMiddleware(GZipMiddleware):
+    """GZip for API JSON; PDF routes pass through untouched so pdf.js keeps Content-Length and range requests."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith(("/uploads/", "/pdf/")):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+# ✅ Compress JSON responses (podcast scripts, section lists) larger than 500 bytes
+app.add_middleware(_ApiGZipMiddleware, minimum_size=500)
+
 BASE_DIR = Path(__file__).resolve().parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-# ✅ Mount uploads dir with proper caching headers for better PDF loading
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
+# ✅ Translate table that drops every ASCII char not allowed in stored filenames
+_ALLOWED_FILENAME_CHARS = frozenset(string.ascii_letters + string.digits + "._-")
+_FILENAME_TRANS = str.maketrans("", "", "".join(chr(i) for i in range(128) if chr(i) not in _ALLOWED_FILENAME_CHARS))
+
+# ✅ Processed-outline cache keyed by (SHA-256 of the PDF bytes, stored filename), bounded LRU.
+# The filename is part of the key because process_pdf special-cases some names.
+PROCESSED_CACHE_MAX = 128
+PROCESSED_CACHE: "OrderedDict[tuple[str, str], dict]" = OrderedDict()
+# In-flight parses, so concurrent uploads of the same bytes and name share one pool job
+_PENDING_PARSES: "dict[tuple[str, str], asyncio.Future]" = {}
+
+# ✅ PDF parsing is CPU-bound, so run it in worker processes to sidestep the GIL.
+# Every gunicorn worker owns its own pool, so keep it small (PDF_WORKERS, default 2)
+# instead of cpu_count(), which would mean (2N+1)*N parser processes per host.
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+# forkserver/spawn instead of fork: workers start lazily from a process that already
+# runs uvloop, anyio threads and gRPC (google.generativeai), none of which are fork-safe.
+_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+
+def _new_executor() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=_MP_CONTEXT)
+
+
+EXECUTOR = _new_executor()
+
+
+async def _run_process_pdf(path: str):
+    """Run process_pdf in the pool, rebuilding it once if a worker crashed natively."""
+    global EXECUTOR
+    loop = asyncio.get_running_loop()
+    executor = EXECUTOR
+    try:
+        return await loop.run_in_executor(executor, process_pdf, path)
+    except BrokenProcessPool:
+        logger.warning("PDF worker pool is broken; rebuilding it and retrying once")
+        if EXECUTOR is executor:  # a concurrent request may already have rebuilt it
+            EXECUTOR = _new_executor()
+            executor.shutdown(wait=False)
+        return await loop.run_in_executor(EXECUTOR, process_pdf, path)
 
 # Load Gemini API key
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "YOUR_GEMINI_API_KEY_HERE")
 
-# Initialize Gemini
-try:
-    genai.configure(api_key=GEMINI_API_KEY)
-    logger.info(f"GEMINI_API_KEY configured: {bool(GEMINI_API_KEY)}")
-    
-    # Test API key validity
-    available_models = [m.name for m in genai.list_models()]
-    logger.info(f"Available Gemini models: {available_models}")
-    
-    DEFAULT_MODEL = "models/gemini-pro"
-    if DEFAULT_MODEL not in available_models:
-        # Try alternative model names
-        for alt_model in ["models/gemini-1.5-flash", "models/gemini-1.5-pro", "models/text-bison-001"]:
-            if alt_model in available_models:
-                DEFAULT_MODEL = alt_model
-                break
-        else:
-            DEFAULT_MODEL = available_models[0] if available_models else None
-    
-    logger.info(f"Using model: {DEFAULT_MODEL}")
-    
-except Exception as e:
-    logger.error(f"Error initializing Gemini: {e}")
-    logger.error(traceback.format_exc())
-    DEFAULT_MODEL = None
+# Gemini state, populated lazily by _get_genai() on first use
+_genai = None
+_genai_lock = threading.Lock()
+AVAILABLE_MODELS = []
+DEFAULT_MODEL = None
+MODEL = None
+
+
+def _get_genai():
+    """Import and initialize google.generativeai on first use.
+
+    The SDK pulls in gRPC/protobuf, so deferring the import keeps worker
+    cold-start (and --reload) fast until a Gemini endpoint is actually hit.
+    """
+    global _genai, AVAILABLE_MODELS, DEFAULT_MODEL, MODEL
+    with _genai_lock:
+        if _genai is not None:
+            return _genai
+
+        import google.generativeai as genai
+
+        try:
+            genai.configure(api_key=GEMINI_API_KEY)
+            logger.info(f"GEMINI_API_KEY configured: {bool(GEMINI_API_KEY)}")
+            
+            # Test API key validity (queried once and cached for /test-gemini)
+            AVAILABLE_MODELS = [m.name for m in genai.list_models()]
+            logger.info(f"Available Gemini models: {AVAILABLE_MODELS}")
+            
+            DEFAULT_MODEL = "models/gemini-pro"
+            if DEFAULT_MODEL not in AVAILABLE_MODELS:
+                # Try alternative model names
+                for alt_model in ["models/gemini-1.5-flash", "models/gemini-1.5-pro", "models/text-bison-001"]:
+                    if alt_model in AVAILABLE_MODELS:
+                        DEFAULT_MODEL = alt_model
+                        break
+                else:
+                    DEFAULT_MODEL = AVAILABLE_MODELS[0] if AVAILABLE_MODELS else None
+            
+            logger.info(f"Using model: {DEFAULT_MODEL}")
+
+            # ✅ Build the model client once and reuse it across requests
+            MODEL = genai.GenerativeModel(DEFAULT_MODEL) if DEFAULT_MODEL else None
+            
+        except Exception:
+            logger.exception("Error initializing Gemini")
+            AVAILABLE_MODELS = []
+            DEFAULT_MODEL = None
+            MODEL = None
+
+        _genai = genai
+        return _genai
 
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "PDF Section Extractor API"}
 
 
+def _norm_section(item):
+    # Outline entries come back either as {"text", "page"} dicts or (text, page) pairs
+    if isinstance(item, dict):
+        return {"text": item["text"], "page": int(item["page"])} if "text" in item and "page" in item else None
+    if isinstance(item, (list, tuple)) and len(item) >= 2:
+        return {"text": str(item[0]), "page": int(item[1])}
+    return None
+
+
+async def _process_pdf_cached(digest: str, path: str):
+    """Return the process_pdf result for `path`, memoized by its SHA-256 digest and basename."""
+    key = (digest, Path(path).name)
+    result = PROCESSED_CACHE.get(key)
+    if result is not None:
+        PROCESSED_CACHE.move_to_end(key)
+        logger.info(f"Reusing cached outline for {key[1]} (sha256: {digest[:12]})")
+        return result
+
+    pending = _PENDING_PARSES.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+
+    pending = asyncio.ensure_future(_run_process_pdf(path))
+    _PENDING_PARSES[key] = pending
+    try:
+        result = await asyncio.shield(pending)
+    finally:
+        _PENDING_PARSES.pop(key, None)
+
+    # Don't cache failures so a retry re-parses the file
+    if not (isinstance(result, dict) and result.get("error")):
+        PROCESSED_CACHE[key] = result
+        if len(PROCESSED_CACHE) > PROCESSED_CACHE_MAX:
+            PROCESSED_CACHE.popitem(last=False)
+    return result
+
+
 @app.post("/upload")
 async def upload_pdf(request: Request, file: UploadFile = File(...)):
     try:
@@ -80,7 +227,10 @@ async def upload_pdf(request: Request, file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="Only PDF files are allowed")
 
         # ✅ Sanitize filename more thoroughly
-        safe_filename = "".join(c for c in file.filename if c.isalnum() or c in "._-").rstrip()
+        if file.filename.isascii():
+            safe_filename = file.filename.translate(_FILENAME_TRANS).rstrip()
+        else:
+            safe_filename = "".join(c for c in file.filename if c.isalnum() or c in "._-").rstrip()
         if not safe_filename.endswith(".pdf"):
             safe_filename += ".pdf"
         
@@ -88,41 +238,46 @@ async def upload_pdf(request: Request, file: UploadFile = File(...)):
 
         # ✅ Check file size (limit to 50MB for better performance)
         file_size = 0
-        with save_path.open("wb") as buffer:
+        hasher = hashlib.sha256()
+        async with aiofiles.open(save_path, "wb") as buffer:
             while chunk := await file.read(8192):  # Read in 8KB chunks
                 file_size += len(chunk)
                 if file_size > 50 * 1024 * 1024:  # 50MB limit
                     save_path.unlink(missing_ok=True)
                     raise HTTPException(status_code=413, detail="File too large. Maximum size is 50MB.")
-                buffer.write(chunk)
+                hasher.update(chunk)
+                await buffer.write(chunk)  # ✅ Non-blocking write keeps the event loop free
 
         logger.info(f"Saved uploaded PDF to {save_path} (size: {file_size/1024/1024:.1f}MB)")
 
-        # Process PDF
-        result = process_pdf(str(save_path))
+        # Process PDF (skipped when identical bytes were uploaded before)
+        result = await _process_pdf_cached(hasher.hexdigest(), str(save_path))
         if isinstance(result, dict) and result.get("error"):
-            return JSONResponse(status_code=500, content={"error": result["error"]})
+            return _ORJSONResponse(status_code=500, content={"error": result["error"]})
 
         outline = result.get("outline", []) if isinstance(result, dict) else result if isinstance(result, list) else []
-        sections = []
-        for item in outline:
-            if isinstance(item, dict) and "text" in item and "page" in item:
-                sections.append({"text": item["text"], "page": int(item["page"])})
-            elif isinstance(item, (list, tuple)) and len(item) >= 2:
-                sections.append({"text": str(item[0]), "page": int(item[1])})
+        sections = [s for s in map(_norm_section, outline) if s is not None]
+
+        title = result.get("title") if isinstance(result, dict) else ""
 
         base_url = str(request.base_url).rstrip("/")
         pdf_url = f"{base_url}/uploads/{safe_filename}"
 
-        return {
+        response = {
             "filename": safe_filename,
             "pdf_url": pdf_url,
             "sections": sections,
-            "title": result.get("title") if isinstance(result, dict) else "",
+            "title": title,
             "file_size": file_size,  # ✅ Include file size in response
             "total_pages": len(sections)  # ✅ Include page count
         }
 
+        # ✅ Opt-in: saves the client a separate /get-insights round trip, at the cost of
+        # this upload waiting for the Gemini call (bounded by AUTO_INSIGHTS_TIMEOUT)
+        if request.query_params.get("auto_insights", "").lower() in ("1", "true", "yes"):
+            response["insights"] = await _auto_insights(title, sections)
+        return response
+
     except HTTPException:
         raise
     except Exception as e:
@@ -130,187 +285,270 @@ async def upload_pdf(request: Request, file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Prompt templates, filled with str.format per request (braces in the JSON examples are escaped)
+_INSIGHTS_PROMPT_TPL = """
+        Analyze the following text and provide analysis in exactly this JSON format:
+        
+        {{
+            "insight": "Brief analytical summary of the key points and significance (2-3 sentences)",
+            "recommendation": "Practical actionable suggestion based on the content (1-2 sentences)"
+        }}
+        
+        Focus on:
+        - Main themes and concepts
+        - Practical implications
+        - Actionable advice
+        - Key takeaways
+        
+        Text to analyze:
+        {text}
+        
+        Respond with ONLY the JSON object, no additional text or formatting.
+        """
+
+_PODCAST_PROMPT_TPL = """
+        Create a natural, engaging podcast conversation between two AI hosts discussing the following content. 
+        
+        ORIGINAL TEXT:
+        {text}
+        
+        ANALYSIS:
+        Insight: {insight}
+        Recommendation: {recommendation}
+        
+        Generate a podcast script with two hosts (Alex - analytical, Sam - practical) discussing this content. Make it conversational, insightful, and engaging.
+        
+        Requirements:
+        - Natural conversational flow with 10-14 total exchanges
+        - Alex focuses on analysis and insights
+        - Sam focuses on practical applications and recommendations
+        - Include questions, agreements, and thoughtful discussions
+        - Make it feel like a real podcast conversation
+        - Each exchange should be 1-3 sentences
+        
+        Format as JSON with this exact structure:
+        {{
+            "title": "Engaging episode title based on the content (max 60 chars)",
+            "duration_estimate": "Estimated duration like '4-6 minutes'",
+            "conversation": [
+                {{
+                    "speaker": "Alex",
+                    "text": "Opening statement about the content...",
+                    "timestamp": "00:00"
+                }},
+                {{
+                    "speaker": "Sam", 
+                    "text": "Response building on Alex's point...",
+                    "timestamp": "00:20"
+                }}
+            ]
+        }}
+        
+        Make the conversation feel natural and dynamic. Include transitions like "That's interesting, Alex..." or "Building on what you said..."
+        """
+
+# ✅ Optimized generation config for better consistency
+_INSIGHTS_GENERATION_CONFIG = {
+    "temperature": 0.6,  # Lower temperature for more consistent results
+    "top_p": 0.8,
+    "top_k": 40,
+    "max_output_tokens": 1024,
+}
+
+# Recovers `"insight": "..."` / `recommendation = "..."` pairs from malformed Gemini JSON
+_FALLBACK_RE = re.compile(r'"?(insight|recommendation)"?\s*[:=]\s*"([^"]*)"', re.I)
+
+# Finds the first ```json ... ``` markdown fence, even with prose before or after it
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+
+
+def _strip_fence(s: str) -> str:
+    s = s.strip()
+    # Bare JSON may itself contain ``` inside string values, so only unwrap non-JSON replies
+    if s.startswith("{"):
+        return s
+    m = _FENCE_RE.search(s)
+    return m.group(1).strip() if m else s
+
+
+# Canned podcast scripts as (speaker, text template, timestamp), rendered by _render_conversation
+_DISCUSSION_PODCAST_TEMPLATE = (
+    ("Alex", "Welcome everyone! Today we're diving into some fascinating content. Here's what caught my attention: {insight}", "00:00"),
+    ("Sam", "That's a really insightful observation, Alex. What I find particularly valuable is the practical angle here.", "00:25"),
+    ("Alex", "Exactly! The analysis reveals some deeper patterns that aren't immediately obvious on first reading.", "00:45"),
+    ("Sam", "And speaking of practical applications, here's what I think our listeners should consider: {recommendation}", "01:10"),
+    ("Alex", "That's such an actionable takeaway, Sam. It bridges the gap between understanding and actually doing something about it.", "01:40"),
+    ("Sam", "Absolutely. Sometimes the most valuable insights come from taking a step back and looking at the bigger picture.", "02:05"),
+    ("Alex", "This type of content analysis really shows how much depth there is in seemingly straightforward material.", "02:30"),
+    ("Sam", "Thanks for joining us in this analysis, everyone. The key is to not just consume content, but to actively engage with it.", "02:55"),
+)
+
+_FALLBACK_PODCAST_TEMPLATE = (
+    ("Alex", "I apologize, but we're experiencing some technical difficulties generating the full podcast discussion.", "00:00"),
+    ("Sam", "However, we can still discuss the key insights from your selected text and provide valuable recommendations.", "00:20"),
+    ("Alex", "The main insight we gathered is: {insight}", "00:40"),
+    ("Sam", "And our recommendation would be: {recommendation}", "01:05"),
+)
+
+
+def _render_conversation(template, insight: str, recommendation: str) -> list:
+    return [
+        {"speaker": speaker, "text": text.format(insight=insight, recommendation=recommendation), "timestamp": ts}
+        for speaker, text, ts in template
+    ]
+
+
+def _clip(s: str, n: int) -> str:
+    return s if len(s) <= n else s[:n] + "..."
+
+
+# ✅ Stripping and length bounds are enforced by pydantic-core before the handler runs
 class TextRequest(BaseModel):
-    text: str
+    model_config = ConfigDict(str_strip_whitespace=True, extra="forbid")
+
+    text: str = Field(..., min_length=1, max_length=20000)
 
 
 class PodcastRequest(BaseModel):
-    text: str
+    model_config = ConfigDict(str_strip_whitespace=True, extra="forbid")
+
+    text: str = Field(..., min_length=1, max_length=20000)
     insight: str
     recommendation: str
 
 
+def _parse_insights(raw_text: str) -> dict:
+    """Turn a raw Gemini insights response into {"insight", "recommendation"}."""
+    # Remove markdown code blocks if present
+    response_text = _strip_fence(raw_text)
+    
+    # Clean up common formatting issues
+    response_text = response_text.strip()
+    if not response_text.startswith("{"):
+        # Find first { and last }
+        start = response_text.find("{")
+        end = response_text.rfind("}") + 1
+        if start != -1 and end > start:
+            response_text = response_text[start:end]
+    
+    try:
+        result = orjson.loads(response_text)
+        logger.info(f"Successfully parsed JSON")
+    except orjson.JSONDecodeError as je:
+        logger.warning(f"JSON decode failed: {je}. Attempting fallback parsing.")
+        
+        # ✅ Single regex pass over the raw response to recover quoted fields
+        result = {"insight": "", "recommendation": ""}
+        for m in _FALLBACK_RE.finditer(raw_text):
+            result[m.group(1).lower()] = m.group(2)
+        
+        # Final fallback - use the whole response
+        if not result.get("insight") and not result.get("recommendation"):
+            response_text = raw_text.strip()
+            if len(response_text) > 100:
+                result["insight"] = _clip(response_text, 300)
+                result["recommendation"] = "Please review the content for actionable steps."
+            else:
+                result["insight"] = response_text
+                result["recommendation"] = "Consider the implications of this content."
+
+    # ✅ Validate and clean the result
+    if not isinstance(result, dict):
+        raise ValueError("Result is not a dictionary")
+    
+    # Ensure required fields exist and have reasonable content
+    insight = result.get("insight", "").strip()
+    recommendation = result.get("recommendation", "").strip()
+    
+    if not insight:
+        insight = "Unable to extract clear insights from the selected text."
+    if not recommendation:
+        recommendation = "Please review the content and consider its practical applications."
+    
+    # Truncate if too long
+    insight = _clip(insight, 500)
+    recommendation = _clip(recommendation, 300)
+    
+    return {
+        "insight": insight,
+        "recommendation": recommendation
+    }
+
+
+# Upper bound on how long /upload?auto_insights=true waits for Gemini
+AUTO_INSIGHTS_TIMEOUT = float(os.getenv("AUTO_INSIGHTS_TIMEOUT", "20"))
+
+
+async def _auto_insights(title: str, sections: list) -> Optional[dict]:
+    """Generate insights from the document title and first sections, or None on failure."""
+    text = "\n".join([title or ""] + [s["text"] for s in sections[:3]]).strip()
+    if not text:
+        return None
+
+    try:
+        if _genai is None:
+            await anyio.to_thread.run_sync(_get_genai)
+        if not MODEL:
+            return None
+
+        # Native async SDK call, so no threadpool hop is needed here
+        response = await asyncio.wait_for(
+            MODEL.generate_content_async(
+                _INSIGHTS_PROMPT_TPL.format(text=text),
+                generation_config=_INSIGHTS_GENERATION_CONFIG,
+            ),
+            timeout=AUTO_INSIGHTS_TIMEOUT,
+        )
+        return _parse_insights(response.text)
+    except asyncio.TimeoutError:
+        logger.warning(f"Auto insights timed out after {AUTO_INSIGHTS_TIMEOUT}s")
+        return None
+    except Exception:
+        logger.exception("Auto insights generation failed")
+        return None
+
+
 @app.post("/get-insights")
 async def get_insights(req: TextRequest):
     logger.info(f"Received insights request for text: {req.text[:100]}...")
     
+    if _genai is None:
+        await anyio.to_thread.run_sync(_get_genai)
     if not DEFAULT_MODEL:
         logger.error("No available Gemini model found")
         raise HTTPException(status_code=500, detail="No available Gemini model found. Please check your API key.")
 
     try:
-        # Validate input
-        if not req.text or len(req.text.strip()) == 0:
-            raise HTTPException(status_code=400, detail="Text cannot be empty")
-        
         # ✅ Improved text preprocessing
-        text = req.text.strip()
+        text = req.text
         if len(text) > 10000:  # Limit text length
             text = text[:10000]
             logger.warning("Text truncated to 10000 characters")
 
         # ✅ Enhanced prompt for better insights
-        prompt = f"""
-        Analyze the following text and provide analysis in exactly this JSON format:
-        
-        {{
-            "insight": "Brief analytical summary of the key points and significance (2-3 sentences)",
-            "recommendation": "Practical actionable suggestion based on the content (1-2 sentences)"
-        }}
-        
-        Focus on:
-        - Main themes and concepts
-        - Practical implications
-        - Actionable advice
-        - Key takeaways
-        
-        Text to analyze:
-        {text}
-        
-        Respond with ONLY the JSON object, no additional text or formatting.
-        """
+        prompt = _INSIGHTS_PROMPT_TPL.format(text=text)
 
         logger.info(f"Using model: {DEFAULT_MODEL}")
-        model = genai.GenerativeModel(DEFAULT_MODEL)
+        model = MODEL
         
-        # ✅ Optimized generation config for better consistency
-        generation_config = {
-            "temperature": 0.6,  # Lower temperature for more consistent results
-            "top_p": 0.8,
-            "top_k": 40,
-            "max_output_tokens": 1024,
-        }
-        
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config
+        # ✅ Run the blocking Gemini SDK call in a worker thread so the event loop stays free
+        response = await anyio.to_thread.run_sync(
+            functools.partial(model.generate_content, prompt, generation_config=_INSIGHTS_GENERATION_CONFIG)
         )
         
         logger.info(f"Raw response: {response.text[:200]}...")
 
         # ✅ Improved JSON parsing with better error handling
-        response_text = response.text.strip()
-        
-        # Remove markdown code blocks if present
-        if response_text.startswith("```"):
-            parts = response_text.split("```")
-            if len(parts) >= 2:
-                response_text = parts[1]
-                if response_text.startswith("json"):
-                    response_text = response_text[4:]
-        
-        # Clean up common formatting issues
-        response_text = response_text.strip()
-        if not response_text.startswith("{"):
-            # Find first { and last }
-            start = response_text.find("{")
-            end = response_text.rfind("}") + 1
-            if start != -1 and end > start:
-                response_text = response_text[start:end]
-        
-        try:
-            result = json.loads(response_text)
-            logger.info(f"Successfully parsed JSON")
-        except json.JSONDecodeError as je:
-            logger.warning(f"JSON decode failed: {je}. Attempting fallback parsing.")
-            
-            # ✅ More robust fallback parsing
-            result = {"insight": "", "recommendation": ""}
-            lines = response.text.split('\n')
-            
-            current_field = None
-            current_value = ""
-            
-            for line in lines:
-                line = line.strip()
-                if not line:
-                    continue
-                    
-                # Check for field indicators
-                if any(x in line.lower() for x in ['insight:', '"insight":', 'analysis:', 'summary:']):
-                    if current_field and current_value:
-                        result[current_field] = current_value.strip()
-                    current_field = "insight"
-                    # Extract value after colon
-                    colon_idx = line.find(':')
-                    if colon_idx != -1:
-                        current_value = line[colon_idx+1:].strip().strip('"').strip(',')
-                    else:
-                        current_value = ""
-                elif any(x in line.lower() for x in ['recommendation:', '"recommendation":', 'action:', 'suggest:']):
-                    if current_field and current_value:
-                        result[current_field] = current_value.strip()
-                    current_field = "recommendation"
-                    # Extract value after colon
-                    colon_idx = line.find(':')
-                    if colon_idx != -1:
-                        current_value = line[colon_idx+1:].strip().strip('"').strip(',')
-                    else:
-                        current_value = ""
-                elif current_field and line:
-                    # Continue building current value
-                    if current_value:
-                        current_value += " " + line.strip().strip('"').strip(',')
-                    else:
-                        current_value = line.strip().strip('"').strip(',')
-            
-            # Don't forget the last field
-            if current_field and current_value:
-                result[current_field] = current_value.strip()
-            
-            # Final fallback - use the whole response
-            if not result.get("insight") and not result.get("recommendation"):
-                response_text = response.text.strip()
-                if len(response_text) > 100:
-                    result["insight"] = response_text[:300] + "..."
-                    result["recommendation"] = "Please review the content for actionable steps."
-                else:
-                    result["insight"] = response_text
-                    result["recommendation"] = "Consider the implications of this content."
-
-        # ✅ Validate and clean the result
-        if not isinstance(result, dict):
-            raise ValueError("Result is not a dictionary")
-        
-        # Ensure required fields exist and have reasonable content
-        insight = result.get("insight", "").strip()
-        recommendation = result.get("recommendation", "").strip()
-        
-        if not insight:
-            insight = "Unable to extract clear insights from the selected text."
-        if not recommendation:
-            recommendation = "Please review the content and consider its practical applications."
-        
-        # Truncate if too long
-        if len(insight) > 500:
-            insight = insight[:500] + "..."
-        if len(recommendation) > 300:
-            recommendation = recommendation[:300] + "..."
-        
-        final_result = {
-            "insight": insight,
-            "recommendation": recommendation
-        }
+        final_result = _parse_insights(response.text)
         
         logger.info(f"Returning result: {final_result}")
         return final_result
 
     except Exception as e:
-        logger.error(f"Error generating insights: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error generating insights")
         
         # Return a user-friendly error response
-        return JSONResponse(
+        return _ORJSONResponse(
             status_code=500, 
             content={
                 "error": f"Failed to generate insights: {str(e)}",
@@ -324,64 +562,25 @@ async def get_insights(req: TextRequest):
 async def generate_podcast(req: PodcastRequest):
     logger.info(f"Received podcast request for text: {req.text[:100]}...")
     
+    if _genai is None:
+        await anyio.to_thread.run_sync(_get_genai)
     if not DEFAULT_MODEL:
         logger.error("No available Gemini model found")
         raise HTTPException(status_code=500, detail="No available Gemini model found. Please check your API key.")
 
     try:
-        # Validate input
-        if not req.text or len(req.text.strip()) == 0:
-            raise HTTPException(status_code=400, detail="Text cannot be empty")
-        
-        text = req.text.strip()
+        text = req.text
         if len(text) > 8000:  # Limit text length for podcast
             text = text[:8000]
             logger.warning("Text truncated to 8000 characters for podcast")
 
         # ✅ Enhanced podcast generation prompt
-        prompt = f"""
-        Create a natural, engaging podcast conversation between two AI hosts discussing the following content. 
-        
-        ORIGINAL TEXT:
-        {text}
-        
-        ANALYSIS:
-        Insight: {req.insight}
-        Recommendation: {req.recommendation}
-        
-        Generate a podcast script with two hosts (Alex - analytical, Sam - practical) discussing this content. Make it conversational, insightful, and engaging.
-        
-        Requirements:
-        - Natural conversational flow with 10-14 total exchanges
-        - Alex focuses on analysis and insights
-        - Sam focuses on practical applications and recommendations
-        - Include questions, agreements, and thoughtful discussions
-        - Make it feel like a real podcast conversation
-        - Each exchange should be 1-3 sentences
-        
-        Format as JSON with this exact structure:
-        {{
-            "title": "Engaging episode title based on the content (max 60 chars)",
-            "duration_estimate": "Estimated duration like '4-6 minutes'",
-            "conversation": [
-                {{
-                    "speaker": "Alex",
-                    "text": "Opening statement about the content...",
-                    "timestamp": "00:00"
-                }},
-                {{
-                    "speaker": "Sam", 
-                    "text": "Response building on Alex's point...",
-                    "timestamp": "00:20"
-                }}
-            ]
-        }}
-        
-        Make the conversation feel natural and dynamic. Include transitions like "That's interesting, Alex..." or "Building on what you said..."
-        """
+        prompt = _PODCAST_PROMPT_TPL.format(
+            text=text, insight=req.insight, recommendation=req.recommendation
+        )
 
         logger.info(f"Generating podcast with model: {DEFAULT_MODEL}")
-        model = genai.GenerativeModel(DEFAULT_MODEL)
+        model = MODEL
         
         # ✅ Optimized settings for creative content
         generation_config = {
@@ -391,78 +590,34 @@ async def generate_podcast(req: PodcastRequest):
             "max_output_tokens": 2048,
         }
         
-        response = model.generate_content(
-            prompt,
-            generation_config=generation_config
+        # ✅ Run the blocking Gemini SDK call in a worker thread so the event loop stays free
+        response = await anyio.to_thread.run_sync(
+            functools.partial(model.generate_content, prompt, generation_config=generation_config)
         )
         
         logger.info(f"Raw podcast response length: {len(response.text)}")
 
         # ✅ Improved JSON parsing for podcast
-        response_text = response.text.strip()
-        
         # Remove markdown code blocks if present
-        if response_text.startswith("```"):
-            parts = response_text.split("```")
-            if len(parts) >= 2:
-                response_text = parts[1]
-                if response_text.startswith("json"):
-                    response_text = response_text[4:]
+        response_text = _strip_fence(response.text)
         
         try:
-            result = json.loads(response_text)
+            result = orjson.loads(response_text)
             logger.info(f"Successfully parsed podcast JSON")
-        except json.JSONDecodeError as je:
+        except orjson.JSONDecodeError as je:
             logger.warning(f"JSON decode failed for podcast: {je}. Creating enhanced fallback.")
             
             # ✅ Create a more sophisticated fallback podcast structure
-            title = f"Discussion: {req.insight[:50]}..." if req.insight else "AI Analysis Discussion"
+            title = f"Discussion: {_clip(req.insight, 50)}" if req.insight else "AI Analysis Discussion"
             
             result = {
                 "title": title,
                 "duration_estimate": "5-7 minutes",
-                "conversation": [
-                    {
-                        "speaker": "Alex",
-                        "text": f"Welcome everyone! Today we're diving into some fascinating content. Here's what caught my attention: {req.insight[:150]}",
-                        "timestamp": "00:00"
-                    },
-                    {
-                        "speaker": "Sam",
-                        "text": "That's a really insightful observation, Alex. What I find particularly valuable is the practical angle here.",
-                        "timestamp": "00:25"
-                    },
-                    {
-                        "speaker": "Alex",
-                        "text": "Exactly! The analysis reveals some deeper patterns that aren't immediately obvious on first reading.",
-                        "timestamp": "00:45"
-                    },
-                    {
-                        "speaker": "Sam",
-                        "text": f"And speaking of practical applications, here's what I think our listeners should consider: {req.recommendation[:150]}",
-                        "timestamp": "01:10"
-                    },
-                    {
-                        "speaker": "Alex",
-                        "text": "That's such an actionable takeaway, Sam. It bridges the gap between understanding and actually doing something about it.",
-                        "timestamp": "01:40"
-                    },
-                    {
-                        "speaker": "Sam",
-                        "text": "Absolutely. Sometimes the most valuable insights come from taking a step back and looking at the bigger picture.",
-                        "timestamp": "02:05"
-                    },
-                    {
-                        "speaker": "Alex",
-                        "text": "This type of content analysis really shows how much depth there is in seemingly straightforward material.",
-                        "timestamp": "02:30"
-                    },
-                    {
-                        "speaker": "Sam",
-                        "text": "Thanks for joining us in this analysis, everyone. The key is to not just consume content, but to actively engage with it.",
-                        "timestamp": "02:55"
-                    }
-                ]
+                "conversation": _render_conversation(
+                    _DISCUSSION_PODCAST_TEMPLATE,
+                    insight=req.insight[:150],
+                    recommendation=req.recommendation[:150],
+                ),
             }
 
         # ✅ Validate and enhance the result
@@ -488,68 +643,92 @@ async def generate_podcast(req: PodcastRequest):
         return result
 
     except Exception as e:
-        logger.error(f"Error generating podcast: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception("Error generating podcast")
         
         # ✅ Return an enhanced fallback podcast
-        return JSONResponse(
+        return _ORJSONResponse(
             status_code=500,
             content={
                 "error": f"Failed to generate podcast: {str(e)}",
                 "title": "Content Analysis Discussion",
                 "duration_estimate": "4-6 minutes",
-                "conversation": [
-                    {
-                        "speaker": "Alex",
-                        "text": "I apologize, but we're experiencing some technical difficulties generating the full podcast discussion.",
-                        "timestamp": "00:00"
-                    },
-                    {
-                        "speaker": "Sam",
-                        "text": "However, we can still discuss the key insights from your selected text and provide valuable recommendations.",
-                        "timestamp": "00:20"
-                    },
-                    {
-                        "speaker": "Alex",
-                        "text": f"The main insight we gathered is: {req.insight if req.insight else 'The content contains valuable information worth analyzing.'}",
-                        "timestamp": "00:40"
-                    },
-                    {
-                        "speaker": "Sam",
-                        "text": f"And our recommendation would be: {req.recommendation if req.recommendation else 'Consider how this information applies to your specific context.'}",
-                        "timestamp": "01:05"
-                    }
-                ]
+                "conversation": _render_conversation(
+                    _FALLBACK_PODCAST_TEMPLATE,
+                    insight=req.insight or "The content contains valuable information worth analyzing.",
+                    recommendation=req.recommendation or "Consider how this information applies to your specific context.",
+                ),
             }
         )
 
 
-# ✅ Enhanced PDF serving with proper headers for better quality
-@app.get("/pdf/{filename}")
-def serve_pdf(filename: str):
+def _is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    # Mirrors StaticFiles.is_not_modified: If-None-Match (lists, W/ tags, "*") wins over If-Modified-Since
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return parsedate_to_datetime(if_modified_since).timestamp() >= int(mtime)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _pdf_file_response(request: Request, filename: str, as_attachment: bool) -> Response:
     file_path = UPLOAD_DIR / filename
-    if not file_path.exists():
+    try:
+        st = file_path.stat()
+    except (OSError, ValueError):  # ValueError: embedded NUL byte in the path
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
         raise HTTPException(status_code=404, detail="PDF file not found")
-    
+
+    # ✅ Revalidate with ETag so unchanged PDFs are answered with a bodyless 304
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {
+        "Cache-Control": "public, max-age=3600",  # Cache for 1 hour
+        "Accept-Ranges": "bytes",  # Enable byte-range requests for better streaming
+        "ETag": etag,
+        "Last-Modified": formatdate(st.st_mtime, usegmt=True),
+    }
+    if _is_not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    # FileResponse streams the file via sendfile where the server supports it
     return FileResponse(
-        path=str(file_path), 
-        media_type="application/pdf", 
-        filename=filename,
-        headers={
-            "Cache-Control": "public, max-age=3600",  # Cache for 1 hour
-            "Accept-Ranges": "bytes",  # Enable byte-range requests for better streaming
-        }
+        path=str(file_path),
+        media_type="application/pdf",
+        filename=filename if as_attachment else None,
+        headers=headers,
+        stat_result=st,
     )
 
 
+# ✅ Serve uploaded PDFs inline (replaces the StaticFiles mount) with ETag caching
+@app.api_route("/uploads/{filename}", methods=["GET", "HEAD"])
+async def serve_upload(request: Request, filename: str):
+    return _pdf_file_response(request, filename, as_attachment=False)
+
+
+# ✅ Enhanced PDF serving with proper headers for better quality
+@app.api_route("/pdf/{filename}", methods=["GET", "HEAD"])
+async def serve_pdf(request: Request, filename: str):
+    return _pdf_file_response(request, filename, as_attachment=True)
+
+
 @app.delete("/clear-uploads")
 def clear_uploads():
     try:
         deleted_count = 0
-        for f in UPLOAD_DIR.glob("*"):
-            if f.is_file():
-                f.unlink()
-                deleted_count += 1
+        # ✅ scandir's DirEntry.is_file() uses the cached dirent type, avoiding a stat per file
+        with os.scandir(UPLOAD_DIR) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    os.unlink(entry.path)
+                    deleted_count += 1
         return {"message": f"Cleared {deleted_count} uploaded files"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -559,18 +738,18 @@ def clear_uploads():
 @app.get("/test-gemini")
 def test_gemini():
     try:
+        _get_genai()
         if not DEFAULT_MODEL:
             return {"status": "error", "message": "No model available"}
         
-        model = genai.GenerativeModel(DEFAULT_MODEL)
-        response = model.generate_content("Hello, this is a test. Please respond with 'Test successful!'")
+        response = MODEL.generate_content("Hello, this is a test. Please respond with 'Test successful!'")
         
         return {
             "status": "success", 
             "model": DEFAULT_MODEL,
             "response": response.text[:200],
             "api_key_configured": bool(GEMINI_API_KEY),
-            "available_models_count": len([m.name for m in genai.list_models()])
+            "available_models_count": len(AVAILABLE_MODELS)
         }
     except Exception as e:
         return {"status": "error", "message": str(e), "traceback": traceback.format_exc()}
@@ -578,7 +757,10 @@ def test_gemini():
 
 # ✅ New endpoint to check system status
 @app.get("/health")
-def health_check():
+async def health_check():
+    # Initialize Gemini on first check so a fresh worker doesn't report a false negative
+    if _genai is None:
+        await anyio.to_thread.run_sync(_get_genai)
     return {
         "status": "healthy",
         "upload_dir_exists": UPLOAD_DIR.exists(),
@@ -589,7 +771,7 @@ def health_check():
 
 # ✅ New endpoint to get available voices (for frontend debugging)
 @app.get("/voices")
-def get_voices_info():
+async def get_voices_info():
     """
     This endpoint provides information about text-to-speech capabilities
     that can be useful for frontend debugging
@@ -607,5 +789,16 @@ def get_voices_info():
     }
 
 
+# Local development only. In production run under gunicorn with multiple workers:
+#   gunicorn -k uvicorn.workers.UvicornWorker -w $((2 * $(nproc) + 1)) -b 0.0.0.0:8000 app:app
 if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
+    import uvicorn
+
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",  # uvloop when installed (not on Windows)
+        http="auto",  # httptools when installed
+        reload=os.getenv("APP_ENV", "development") != "production",
+    )
\ No newline at end of file